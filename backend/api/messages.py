@@ -1,14 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from storage.database import supabase, get_current_user, get_user_supabase_client
+from storage.database import get_current_user, get_user_supabase_client
 from models.message import MessageCreate, MessageResponse, MessageUpdate
 from models.user import User
 from utils.logger import logger
 from scripts.context_manager import create_prompt
 from utils.user_security import get_security_service
+import asyncio
 import uuid
-import json
+import orjson
 from datetime import datetime
 from services.drive_agent import create_drive_agent
 
@@ -29,7 +30,10 @@ def get_authenticated_supabase(
             detail="Failed to authenticate with database"
         )
 
-@router.post("/chat/{chat_id}", response_model=MessageResponse)
+# Rows come back from Supabase already deserialised, so they are sent as-is with orjson
+# instead of being re-validated against MessageResponse; the model still documents the shape
+@router.post("/chat/{chat_id}", response_model=None, response_class=ORJSONResponse,
+             responses={200: {"model": MessageResponse}})
 async def create_message(
     chat_id: str,
     message: MessageCreate,
@@ -38,7 +42,7 @@ async def create_message(
 ):
     try:
         start_time = datetime.utcnow()
-        chat_response = user_supabase.table("chats").select("id, metadata").eq("id", chat_id).eq("user_id", current_user.id).execute()
+        chat_response = user_supabase.table("chats").select("id, metadata, context_summary").eq("id", chat_id).eq("user_id", current_user.id).execute()
         if not chat_response.data:
             raise HTTPException(status_code=404, detail="Chat not found")
         if message.role != 'user':
@@ -49,7 +53,8 @@ async def create_message(
         if not message_check.allowed:
             raise HTTPException(status_code=403, detail=message_check.reason)
         # Use new context_manager prompt
-        prompt = await create_prompt(user_supabase, current_user.id, chat_id, message.content)
+        prompt = await create_prompt(user_supabase, current_user.id, chat_id, message.content,
+                                     chat_response.data[0].get("context_summary") or "")
         agent = create_drive_agent(current_user.id, user_supabase)
         ai_response_text = await agent.aprocess_message(prompt)
         estimated_tokens = (len(message.content) + len(ai_response_text)) // 4
@@ -70,12 +75,12 @@ async def create_message(
                 "security_context_applied": True
             }
         }
-        response = user_supabase.table("messages").insert(ai_message_data).execute()
         end_time = datetime.utcnow()
         total_original_messages = chat_response.data[0]["metadata"].get("totalMessages", 0)
-        user_supabase.table("chats").update(
-            {"updated_at": datetime.utcnow().isoformat(),
-             "context_summary": ai_response_text["context_summary"],
+        insert_query = user_supabase.table("messages").insert(ai_message_data)
+        # updated_at is set by the update_chat_metadata_on_message_insert trigger
+        chat_query = user_supabase.table("chats").update(
+            {"context_summary": ai_response_text["context_summary"],
              "metadata": {
                 "totalMessages": total_original_messages + 2,
                 "totalTokens": (chat_response.data[0]["metadata"].get("totalTokens") if chat_response.data[0].get("metadata") else 0) + estimated_tokens,
@@ -84,9 +89,12 @@ async def create_message(
                     + 2 * (end_time - start_time).total_seconds()
                 ) / (total_original_messages + 2),
              }}
-          ).eq("id", chat_id).execute()
+          ).eq("id", chat_id)
+        # The chat counters are only bumped once the message is actually stored
+        response = await asyncio.to_thread(insert_query.execute)
+        await asyncio.to_thread(chat_query.execute)
         logger.info(f"AI message saved: {ai_message_data['id']}")
-        return response.data[0]
+        return ORJSONResponse(response.data[0])
     except Exception as e:
         logger.error(f"Error creating message in chat {chat_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Message creation failed")
@@ -137,7 +145,8 @@ async def create_message_stream(
 
         async def generate_response():
             try:
-                prompt = await create_prompt(user_supabase, current_user.id, chat_id, message.content)
+                prompt = await create_prompt(user_supabase, current_user.id, chat_id, message.content,
+                                             chat_data.get("context_summary") or "")
                 from services.generative_ai import generate_text
                 ai_response_text = generate_text(prompt=prompt)
                 ai_message_data = {
@@ -152,13 +161,13 @@ async def create_message_stream(
                         "context_summary_updated": True
                     }
                 }
-                ai_response = user_supabase.table("messages").insert(ai_message_data).execute()
-                user_supabase.table("chats").update({"updated_at": datetime.utcnow().isoformat()}).eq("id", chat_id).execute()
+                # The update_chat_metadata_on_message_insert trigger bumps the chat's updated_at
+                ai_response = await asyncio.to_thread(user_supabase.table("messages").insert(ai_message_data).execute)
                 logger.info(f"AI streaming message saved: {ai_message_data['id']}")
-                yield f"data: {json.dumps({'type': 'complete', 'message': ai_response.data[0]})}\n\n"
+                yield b"data: " + orjson.dumps({'type': 'complete', 'message': ai_response.data[0]}) + b"\n\n"
             except Exception as e:
                 logger.error(f"Error in streaming response: {str(e)}")
-                yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+                yield b"data: " + orjson.dumps({'type': 'error', 'error': str(e)}) + b"\n\n"
 
         return StreamingResponse(
             generate_response(),
@@ -183,32 +192,27 @@ async def create_message_stream(
             detail=f"Streaming message creation failed: {error_detail}")
 
 # TODO: A placeholder for the message update endpoint. Not using currently.
-@router.put("/{message_id}", response_model=MessageResponse)
+@router.put("/{message_id}", response_model=None, response_class=ORJSONResponse,
+            responses={200: {"model": MessageResponse}})
 async def update_message(
     message_id: str,
     message: MessageUpdate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    user_supabase=Depends(get_authenticated_supabase)
 ):
     """Update a message"""
     try:
-        # Get message and verify user has access to the chat
-        response = supabase.table("messages").select(
-            "*, chats!inner(user_id)").eq("id", message_id).execute()
-        if not response.data:
-            raise HTTPException(status_code=404, detail="Message not found")
-        existing_message = response.data[0]
-        # Check if user owns the chat
-        if existing_message["chats"]["user_id"] != current_user.id:
-            raise HTTPException(status_code=403, detail="Access denied")
-        # Update message
+        # RLS only lets the chat owner update, so a missing or foreign message yields no rows
         update_data = {"updated_at": datetime.utcnow().isoformat()}
         if message.content is not None:
             update_data["content"] = message.content
         if message.metadata is not None:
             update_data["metadata"] = message.metadata
-        response = supabase.table("messages").update(
+        response = user_supabase.table("messages").update(
             update_data).eq("id", message_id).execute()
-        return response.data[0]
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Message not found")
+        return ORJSONResponse(response.data[0])
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
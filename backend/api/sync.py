@@ -2,14 +2,34 @@ from utils.sanitize import remove_null_chars
 from fastapi import APIRouter, HTTPException, Depends, status
 from utils.logger import logger
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from storage.database import get_current_user, get_user_supabase_client
-from scripts.google_drive import GoogleDriveService
-from scripts.chroma import embed_chunks, remove_file as chroma_remove_file
+from storage.database import get_current_user, get_user_supabase_client, select_all
+from scripts.google_drive import get_drive_service
+from scripts.chroma import (
+    embed_files,
+    flush_writes,
+    update_files_metadata,
+    get_file_checksums,
+    remove_files as chroma_remove_files,
+    get_cached_response,
+    cache_response,
+)
 from datetime import datetime
 from services.generative_ai import generate_text
 from utils.sanitize import extract_json_from_string
+from utils.timestamps import same_timestamp
+from services.additional_tools import invalidate_file_metadata_cache
+import asyncio
 import uuid
 
+DOWNLOAD_CONCURRENCY = 8
+EMBED_CONCURRENCY = 4
+# Chunks per embedding request and Chroma add; Gemini caps batch embedding at 100 texts
+EMBED_BATCH_SIZE = 100
+# Characters of downloaded text grouped into one embed call, roughly 256 chunks of 1000 characters
+EMBED_GROUP_CHARS = 256_000
+# Files described per Gemini request when generating summaries and tags
+FILE_METADATA_BATCH_SIZE = 20
+
 router = APIRouter(prefix="/api/sync", tags=["sync"])
 security = HTTPBearer()
 
@@ -19,13 +39,97 @@ def get_authenticated_supabase(credentials: HTTPAuthorizationCredentials = Depen
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to authenticate with database")
 
+def get_page_token(user_supabase, user_id: str):
+    """Drive changes page token saved by the user's last completed sync, if any."""
+    try:
+        response = user_supabase.table("drive_sync_state").select("page_token").eq("user_id", user_id).execute()
+        return response.data[0]["page_token"] if response.data else None
+    except Exception as e:
+        logger.error(f"Failed to read drive sync state: {e}")
+        return None
+
+def save_page_token(user_supabase, user_id: str, page_token: str, now: str):
+    try:
+        user_supabase.table("drive_sync_state").upsert({
+            "user_id": user_id,
+            "page_token": page_token,
+            "updated_at": now
+        }).execute()
+    except Exception as e:
+        logger.error(f"Failed to save drive sync state: {e}")
+
+def get_changed_ids(drive_changes, supabase_files_map):
+    """Ids a changes feed touched plus their parent folders, or None if a folder itself changed."""
+    # Stored folder ids by path; removed and trashed items no longer report their parents
+    folder_ids_by_path = {row['file_path']: row['id'] for row in supabase_files_map.values()
+                          if row.get('file_type') is False and row.get('file_path')}
+    changed_ids = set()
+    for change in drive_changes:
+        drive_file = change.get('file') or {}
+        meta = supabase_files_map.get(change['fileId'])
+        # A renamed, moved or deleted folder changes everything below it
+        if drive_file.get('mimeType') == 'application/vnd.google-apps.folder' or (meta and meta.get('file_type') is False):
+            return None
+        changed_ids.add(change['fileId'])
+        changed_ids.update(drive_file.get('parents', []))
+        # The folder the item was recorded in, which also covers the old parent of a moved file
+        if meta and meta.get('file_path'):
+            parent_id = folder_ids_by_path.get(meta['file_path'].rsplit('/', 1)[0])
+            if parent_id:
+                changed_ids.add(parent_id)
+    return changed_ids
+
+def generate_metadata(prompt: str):
+    """Parse Gemini summary/tags for a prompt, reusing the response to an identical earlier prompt."""
+    cached = get_cached_response(prompt)
+    if cached is not None:
+        return extract_json_from_string(cached)
+    ai_result = generate_text(prompt)
+    parsed = extract_json_from_string(ai_result)
+    if parsed:
+        cache_response(prompt, ai_result)
+    return parsed
+
+def generate_file_metadata(drive_items):
+    """Gemini summary/tags for many files, FILE_METADATA_BATCH_SIZE per request, keyed by file id."""
+    results = {}
+    for start in range(0, len(drive_items), FILE_METADATA_BATCH_SIZE):
+        batch = drive_items[start:start + FILE_METADATA_BATCH_SIZE]
+        listing = "\n".join(f"{item['id']}: {item['name']}" for item in batch)
+        prompt = (
+            f"For each of the following files, generate a short summary describing its content and significance, and suggest 3-5 relevant tags. "
+            f"Return the result as a JSON object mapping each file ID to an object with keys 'summary' (string, max 200 chars) and 'tags' (array of strings, 3-5 items).\n"
+            f"Files (ID: name):\n{listing}\n"
+        )
+        # Not through the prompt cache: a cached answer for another batch is keyed by other file ids
+        parsed = extract_json_from_string(generate_text(prompt))
+        if not isinstance(parsed, dict):
+            parsed = {}
+        for item in batch:
+            entry = parsed.get(item['id'])
+            results[item['id']] = entry if isinstance(entry, dict) else {}
+    return results
+
 @router.post("/drive")
 async def sync_drive(
     current_user=Depends(get_current_user),
     user_supabase=Depends(get_authenticated_supabase)
 ):
     """Sync Google Drive with ChromaDB and Supabase file_metadata."""
-    drive_service = GoogleDriveService()
+    drive_service = get_drive_service()
+    now_dt = datetime.utcnow()
+    now = now_dt.isoformat()
+    # 0. Skip the full listing when the Drive changes feed is empty since the last sync
+    page_token = get_page_token(user_supabase, current_user.id)
+    drive_changes = None
+    if page_token:
+        drive_changes, next_page_token = drive_service.list_changes(page_token)
+        if not drive_changes:
+            save_page_token(user_supabase, current_user.id, next_page_token, now)
+            return {"status": "no changes", "changes": []}
+    else:
+        # Taken before listing so that changes made during this sync are picked up next time
+        next_page_token = drive_service.get_start_page_token()
     # 1. List all files in Drive
     # Recursively list all files and folders starting from root
     all_drive_items = drive_service.list_files_recursively()
@@ -42,12 +146,19 @@ async def sync_drive(
             current = drive_items_map.get(parents[0])
         return '/' + '/'.join(parts)
     # 2. Get all file_metadata from Supabase
-    supabase_files = user_supabase.table("file_metadata").select("*").execute().data or []
+    supabase_files = select_all(lambda: user_supabase.table("file_metadata").select("*").order("id"))
     logger.info(f"Supabase file_metadata rows: {len(supabase_files)}")
     supabase_files_map = {f['id']: f for f in supabase_files}
+    # Items to re-check against Supabase; None means every item
+    changed_ids = get_changed_ids(drive_changes, supabase_files_map) if drive_changes else None
     changes = []
-    now = datetime.utcnow().isoformat()
     gemini_cache = {}
+    to_embed = []
+    # Rows of files being re-embedded or relabelled in Chroma, written once that has succeeded
+    pending_rows = {}
+    # New chunk metadata for files whose name, place or description changed but whose content did not
+    metadata_updates = {}
+    changed_files = []
     # 3. Bottom-up sync: process files first, then folders
     logger.info("Starting bottom-up sync...")
     # 3a. Process files (non-folders)
@@ -56,6 +167,8 @@ async def sync_drive(
             continue
         logger.info(f"Processing file item_id: {item_id}, name: {drive_item.get('name')}")
         meta = supabase_files_map.get(item_id)
+        if meta and changed_ids is not None and item_id not in changed_ids:
+            continue
         drive_mtime = drive_item.get('modifiedTime') or drive_item.get('modified_time')
         file_path = build_full_path(item_id)
         changed = False
@@ -67,84 +180,174 @@ async def sync_drive(
             if (
                 meta.get('file_name') != drive_item['name'] or
                 meta_parent != drive_parent or
-                (meta.get('updated_at') or '') != (drive_mtime or '') or
-                str(meta.get('tags', '')) != str(meta.get('tags', '')) or
-                meta.get('summary', '') != meta.get('summary', '') or
-                meta.get('file_path', '') != file_path or
-                (meta.get('size', None) != drive_item.get('size', None))
+                not same_timestamp(meta.get('updated_at'), drive_mtime) or
+                meta.get('file_path', '') != file_path
             ):
                 changed = True
         if changed:
-            summary = meta['summary'] if meta and meta.get('summary') else None
-            tags = meta['tags'] if meta and meta.get('tags') else []
-            chroma_tags = ', '.join(tags) if isinstance(tags, list) else (tags or '')
-            text = None
-            cache_key = f"file:{item_id}"
-            parsed = gemini_cache.get(cache_key)
-            if not summary or not tags:
-                if parsed is None:
-                    prompt = (
-                        f"Given the following file, generate a short summary describing its content and significance, and suggest 3-5 relevant tags. "
-                        f"Return the result as a JSON object with keys 'summary' (string, max 200 chars) and 'tags' (array of strings, 3-5 items).\n"
-                        f"File Name: {drive_item['name']}\n"
-                    )
-                    if text:
-                        prompt += f"File Content (truncated):\n{text[:2000]}"
-                    ai_result = generate_text(prompt)
-                    parsed = extract_json_from_string(ai_result)
-                    gemini_cache[cache_key] = parsed or {}
-                if parsed:
-                    summary = parsed.get('summary', f"No summary available for {drive_item['name']}")
-                    tags = parsed.get('tags', [])
-                else:
-                    summary = f"No summary available for {drive_item['name']}"
-                    tags = []
-            text = drive_service.download_and_get_file_content(item_id, drive_item['mimeType'])
-            embed_chunks(
-                text,
-                item_id,
-                drive_item['name'],
-                drive_mtime,
-                float(drive_item.get('size', 0)) / (1024*1024),
-                drive_item.get('parents', [''])[0],
-                chroma_tags,
-                summary,
-            )
-            upsert_data = {
-                "id": item_id,
-                "file_type": True,
+            changed_files.append((drive_item, meta, drive_mtime, file_path))
+    # Describe every changed file lacking a summary or tags in a few batched Gemini requests
+    needs_ai = [drive_item for drive_item, meta, _, _ in changed_files
+                if not (meta and meta.get('summary') and meta.get('tags'))]
+    for file_id, parsed in generate_file_metadata(needs_ai).items():
+        gemini_cache[f"file:{file_id}"] = parsed
+    # Checksums of what is embedded now, for every changed file that has one on Drive, in one query
+    embedded_checksums = get_file_checksums(
+        [drive_item['id'] for drive_item, _, _, _ in changed_files if drive_item.get('md5Checksum')])
+    for drive_item, meta, drive_mtime, file_path in changed_files:
+        item_id = drive_item['id']
+        summary = meta.get('summary') if meta else None
+        tags = (meta.get('tags') if meta else None) or []
+        parsed = gemini_cache.get(f"file:{item_id}")
+        if parsed is not None:
+            if parsed:
+                summary = parsed.get('summary', f"No summary available for {drive_item['name']}")
+                tags = parsed.get('tags', [])
+            else:
+                summary = f"No summary available for {drive_item['name']}"
+                tags = []
+        needs_embed = False
+        # Only re-download and re-embed when the content may have changed
+        if not meta or not same_timestamp(meta.get('updated_at'), drive_mtime):
+            checksum = drive_item.get('md5Checksum')
+            # Binary files carry a content hash; skip the download when the embedded copy matches it
+            if checksum and embedded_checksums.get(item_id) == checksum:
+                logger.info(f"Content unchanged, keeping embeddings for {drive_item['name']}")
+            else:
+                to_embed.append((drive_item, drive_mtime, tags, summary))
+                needs_embed = True
+        upsert_data = {
+            "id": item_id,
+            "file_type": True,
+            "file_name": drive_item['name'],
+            "file_path": file_path,
+            "summary": summary,
+            "tags": tags,
+            "updated_at": drive_mtime or now,
+        }
+        if meta and not needs_embed:
+            parent_folder_id = drive_item.get('parents', [''])[0]
+            metadata_updates[item_id] = {
                 "file_name": drive_item['name'],
-                "file_path": file_path,
-                "summary": summary,
-                "tags": tags,
-                "updated_at": drive_mtime or now,
+                "file_path": f"{parent_folder_id}/{drive_item['name']}",
+                "parent_folder": parent_folder_id,
+                "summary": summary or "",
+                "tags": ",".join(tags) if isinstance(tags, list) else (tags or ""),
+                "modified_time": drive_mtime or "",
             }
-            logger.info(f"Upserting file into Supabase: {upsert_data}")
-            user_supabase.table("file_metadata").upsert(remove_null_chars(upsert_data)).execute()
-            changes.append({"type": "added" if not meta else "modified", "file_id": item_id, "file_name": drive_item['name']})
+        change = {"type": "added" if not meta else "modified", "file_id": item_id, "file_name": drive_item['name']}
+        if needs_embed or item_id in metadata_updates:
+            # Recorded only once Chroma is up to date: the row is what tells the next sync whether
+            # this version still needs embedding or relabelling
+            pending_rows[item_id] = (upsert_data, change)
+            continue
+        logger.info(f"Upserting file into Supabase: {upsert_data}")
+        user_supabase.table("file_metadata").upsert(remove_null_chars(upsert_data)).execute()
+        changes.append(change)
+    # Downloaded files are grouped until they hold about a Chroma add window of text, then each
+    # group is embedded together while later downloads continue; both stages run off the event
+    # loop in worker threads, bounded separately, and the store serialises the Chroma writes
+    download_semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    embed_semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    embed_tasks = []
+    pending_docs, pending_chars = [], 0
+    # Files whose download or embedding failed; their rows and the page token are left as they were
+    failed_ids = set()
+    # Files whose background Chroma writes failed, filled in by this sync's writes only
+    write_failures = set()
+    async def embed_group(documents):
+        async with embed_semaphore:
+            try:
+                results = await asyncio.to_thread(
+                    embed_files, documents, batch_size=EMBED_BATCH_SIZE, failures=write_failures)
+                failed_ids.update(file_id for file_id, ok in results.items() if not ok)
+            except Exception as e:
+                logger.error(f"Failed to embed {len(documents)} files: {e}")
+                failed_ids.update(doc['file_id'] for doc in documents)
+    def flush_pending():
+        nonlocal pending_docs, pending_chars
+        if pending_docs:
+            embed_tasks.append(asyncio.create_task(embed_group(pending_docs)))
+            pending_docs, pending_chars = [], 0
+    async def download(drive_item, drive_mtime, tags, summary):
+        nonlocal pending_chars
+        try:
+            async with download_semaphore:
+                text = await asyncio.to_thread(
+                    drive_service.download_and_get_file_content, drive_item['id'], drive_item['mimeType'], drive_mtime)
+        except Exception as e:
+            logger.error(f"Failed to download {drive_item['name']}: {e}")
+            failed_ids.add(drive_item['id'])
+            return
+        if not (text and text.strip()):
+            # Unsupported or empty content; nothing to embed, but the file itself is synced
+            logger.info(f"No text to embed for {drive_item['name']}")
+            return
+        pending_docs.append({
+            "text": text,
+            "file_id": drive_item['id'],
+            "file_name": drive_item['name'],
+            "modified_time": drive_mtime,
+            "size_mb": float(drive_item.get('size', 0)) / (1024*1024),
+            "parent_folder_id": drive_item.get('parents', [''])[0],
+            "tags": tags,
+            "summary": summary,
+            "checksum": drive_item.get('md5Checksum', ''),
+        })
+        pending_chars += len(text or '')
+        if pending_chars >= EMBED_GROUP_CHARS:
+            flush_pending()
+    await asyncio.gather(*(download(*job) for job in to_embed))
+    flush_pending()
+    await asyncio.gather(*embed_tasks)
+    # Embedded chunks are written in the background; make sure they are stored before reporting
+    await asyncio.to_thread(flush_writes)
+    if write_failures:
+        logger.error(f"Failed to write chunks for {len(write_failures)} files; they will be retried on the next sync")
+        failed_ids.update(write_failures)
+    # Renamed or moved files keep their embeddings, but their chunks must not keep the old names
+    if not await asyncio.to_thread(update_files_metadata, metadata_updates):
+        failed_ids.update(metadata_updates)
+    for item_id, (upsert_data, change) in pending_rows.items():
+        if item_id in failed_ids:
+            logger.warning(f"Not recording {change['file_name']}; it will be retried on the next sync")
+            continue
+        logger.info(f"Upserting file into Supabase: {upsert_data}")
+        user_supabase.table("file_metadata").upsert(remove_null_chars(upsert_data)).execute()
+        changes.append(change)
     # 3b. Process folders bottom-up (children before parents)
     # Sort folders by depth (deepest first)
     folders = [item for item in all_drive_items if item['mimeType'] == 'application/vnd.google-apps.folder']
+    # Index direct child files by parent once instead of rescanning every item per folder
+    files_by_parent = {}
+    for item in all_drive_items:
+        if item.get('parents') and item['mimeType'] != 'application/vnd.google-apps.folder':
+            files_by_parent.setdefault(item['parents'][0], []).append(item)
+    # Memoized so each folder's ancestor chain is walked once rather than once per descendant
+    depth_cache = {}
     def get_depth(item):
-        depth = 0
-        current = item
-        while current.get('parents') and len(current['parents']) > 0:
-            parent_id = current['parents'][0]
-            parent = drive_items_map.get(parent_id)
+        item_id = item['id']
+        if item_id not in depth_cache:
+            parents = item.get('parents')
+            parent = drive_items_map.get(parents[0]) if parents else None
             if not parent or parent['mimeType'] != 'application/vnd.google-apps.folder':
-                break
-            depth += 1
-            current = parent
-        return depth
+                depth_cache[item_id] = 0
+            else:
+                depth_cache[item_id] = get_depth(parent) + 1
+        return depth_cache[item_id]
     folders_sorted = sorted(folders, key=get_depth, reverse=True)
     for folder in folders_sorted:
         item_id = folder['id']
         logger.info(f"Processing folder item_id: {item_id}, name: {folder.get('name')}")
         meta = supabase_files_map.get(item_id)
+        if meta and changed_ids is not None and item_id not in changed_ids:
+            continue
         drive_mtime = folder.get('modifiedTime') or folder.get('modified_time')
         folder_path = build_full_path(item_id)
         changed = False
-        if not meta:
+        # Folders only reach here from the changes feed as parents of an added, edited, moved or
+        # removed item, so their summary is rebuilt from the current children
+        if not meta or changed_ids is not None:
             changed = True
         else:
             meta_parent = meta.get('file_path', '').rsplit('/', 1)[0] if meta.get('file_path') else ''
@@ -152,15 +355,12 @@ async def sync_drive(
             if (
                 meta.get('file_name') != folder['name'] or
                 meta_parent != drive_parent or
-                (meta.get('updated_at') or '') != (drive_mtime or '') or
+                not same_timestamp(meta.get('updated_at'), drive_mtime) or
                 meta.get('file_path', '') != folder_path
             ):
                 changed = True
         if changed:
-            contained_files = [
-                f for f in all_drive_items
-                if f.get('parents') and len(f['parents']) > 0 and f['parents'][0] == item_id and f['mimeType'] != 'application/vnd.google-apps.folder'
-            ]
+            contained_files = files_by_parent.get(item_id, [])
             contained_summaries = []
             for f in contained_files:
                 meta_f = supabase_files_map.get(f['id'])
@@ -183,8 +383,7 @@ async def sync_drive(
                     f"Return the result as a JSON object with keys 'summary' (string, max 200 chars) and 'tags' (array of strings, 3-5 items).\n"
                     f"Folder Name: {folder['name']}\nFiles and summaries:\n{folder_context}"
                 )
-                ai_result = generate_text(prompt)
-                parsed = extract_json_from_string(ai_result)
+                parsed = generate_metadata(prompt)
                 gemini_cache[cache_key] = parsed or {}
             if parsed:
                 summary = parsed.get('summary', "")
@@ -204,17 +403,25 @@ async def sync_drive(
             user_supabase.table("file_metadata").upsert(remove_null_chars(upsert_data)).execute()
             changes.append({"type": "added" if not meta else "modified", "file_id": item_id, "file_name": folder['name']})
     # 4. Remove deleted files from Chroma and Supabase
-    for file_id, meta in supabase_files_map.items():
-        if file_id not in drive_items_map:
-            chroma_remove_file(file_id)
-            delete_result = user_supabase.table("file_metadata").delete().eq("id", file_id).execute()
-            logger.info(f"Delete result: {delete_result}")
-            changes.append({"type": "deleted", "file_id": file_id, "file_name": meta['file_name']})
+    deleted_ids = list(set(supabase_files_map) - set(drive_items_map))
+    if deleted_ids:
+        chroma_remove_files(deleted_ids)
+        drive_service.forget_file_contents(deleted_ids)
+        delete_result = user_supabase.table("file_metadata").delete().in_("id", deleted_ids).execute()
+        logger.info(f"Delete result: {delete_result}")
+        for file_id in deleted_ids:
+            changes.append({"type": "deleted", "file_id": file_id, "file_name": supabase_files_map[file_id]['file_name']})
+    if failed_ids:
+        # Keep the old token so the next sync replays these changes and retries the failed files
+        logger.warning(f"{len(failed_ids)} files failed to embed; keeping the previous Drive page token")
+    else:
+        save_page_token(user_supabase, current_user.id, next_page_token, now)
     # 5. Create version and change entries only if there are changes
     if not changes:
         return {"status": "no changes", "changes": []}
+    invalidate_file_metadata_cache()
     version_data = {
-        "version": f"v{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}",
+        "version": f"v{now_dt.strftime('%Y%m%d_%H%M%S')}",
         "title": "Drive Sync",
         "description": f"Drive sync performed at {now}",
         "user_id": current_user.id,
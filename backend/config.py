@@ -1,11 +1,12 @@
 import os
-from typing import Optional
+from dataclasses import dataclass
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 
+@dataclass(slots=True, frozen=True)
 class Settings:
     # Supabase Configuration
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
@@ -26,13 +27,12 @@ class Settings:
     GOOGLE_CREDENTIALS_PATH: str = os.getenv(
         "GOOGLE_CREDENTIALS_PATH", "credentials.json")
 
-    @classmethod
-    def validate(cls, raise_on_missing: bool = True):
+    def validate(self, raise_on_missing: bool = True):
         """Validate required environment variables"""
         from utils.logger import logger
 
         required_vars = ["SUPABASE_URL", "SUPABASE_ANON_KEY", "GEMINI_API_KEY"]
-        missing_vars = [var for var in required_vars if not getattr(cls, var)]
+        missing_vars = [var for var in required_vars if not getattr(self, var)]
 
         if missing_vars:
             error_msg = f"""Missing required environment variables: {', '.join(missing_vars)}"""
@@ -57,7 +57,6 @@ class Settings:
     @property
     def is_google_drive_configured(self) -> bool:
         """Check if Google Drive configuration is present"""
-        import os
         return (os.path.exists(self.GOOGLE_CREDENTIALS_PATH) or
                 bool(os.getenv('GOOGLE_APPLICATION_CREDENTIALS')))
 
@@ -2,91 +2,107 @@ from api import messages
 from api import sync
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 import uvicorn
+from contextlib import asynccontextmanager
 import asyncio
 from config import settings
 from utils.logger import logger
 from utils.task_processor import task_processor
+from scripts.chroma import get_store
 
-# Initialize FastAPI app
-app = FastAPI(
-    title="Archyx AI API",
-    description="Backend API for the Archyx AI chat application",
-    version="1.0.0"
-)
+DEV_ORIGIN_REGEX = r"^https?://(localhost|127\.0\.0\.1)(:\d+)?$"
 
-# Security middleware - restrict hosts in production
-if not settings.DEBUG:
-    app.add_middleware(
-        TrustedHostMiddleware,
-        allowed_hosts=[
-            "localhost",
-            "127.0.0.1",
-            "*.herokuapp.com",
-            "*.vercel.app"]
-    )
-
-# CORS middleware
-allowed_origins = [
-    settings.FRONTEND_URL,
-    "http://localhost:3000",
-    "http://127.0.0.1:3000",
-]
-
-# Only allow all origins in debug mode
-if settings.DEBUG:
-    allowed_origins.extend([
-        "http://localhost:8080",
-        "http://127.0.0.1:8080",
-    ])
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=allowed_origins,
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Authorization", "Content-Type"],
-    max_age=3600,
-)
-
-# Add preflight handler for CORS
-
-
-@app.options("/{full_path:path}")
-async def options_handler(full_path: str):
-    return {"detail": "OK"}
-
-# Health check endpoint
 
+def _mount_hosts(app: FastAPI, config) -> None:
+    """Security middleware - restrict hosts in production"""
+    if not config.DEBUG:
+        app.add_middleware(
+            TrustedHostMiddleware,
+            allowed_hosts=[
+                "localhost",
+                "127.0.0.1",
+                "*.herokuapp.com",
+                "*.vercel.app"]
+        )
 
-@app.get("/")
-async def root():
-    logger.info("Health check endpoint accessed")
-    return {"message": "Archyx AI API is running"}
 
-# Include routers - computation-heavy operations only
-# Note: Chat CRUD operations moved to frontend API routes
-# AI processing and streaming
-app.include_router(messages.router)
-# Drive/Chroma/Supabase sync endpoint
-app.include_router(sync.router)
-# Note: Drive operations available via services but no HTTP endpoints yet
+def _mount_cors(app: FastAPI, config) -> None:
+    """CORS middleware"""
+    # A frozenset makes Starlette's per-request origin check a hash lookup
+    allowed_origins = frozenset(origin for origin in (
+        config.FRONTEND_URL,
+        "http://localhost:3000",
+        "http://127.0.0.1:3000",
+    ) if origin)
 
-# Startup and shutdown events
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=allowed_origins,
+        # Any local dev port in debug mode, matched by a single compiled regex
+        allow_origin_regex=DEV_ORIGIN_REGEX if config.DEBUG else None,
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["Authorization", "Content-Type"],
+        max_age=3600,
+    )
 
 
-@app.on_event("startup")
-async def startup_event():
+def _mount_routes(app: FastAPI) -> None:
+    # Add preflight handler for CORS
+    @app.options("/{full_path:path}")
+    async def options_handler(full_path: str):
+        return {"detail": "OK"}
+
+    # Health check endpoint
+    @app.get("/")
+    async def root():
+        logger.info("Health check endpoint accessed")
+        return {"message": "Archyx AI API is running"}
+
+    # Include routers - computation-heavy operations only
+    # Note: Chat CRUD operations moved to frontend API routes
+    # AI processing and streaming
+    app.include_router(messages.router)
+    # Drive/Chroma/Supabase sync endpoint
+    app.include_router(sync.router)
+    # Note: Drive operations available via services but no HTTP endpoints yet
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup and shutdown in one coroutine"""
+    # Open the Chroma store and embedding client before the first request instead of during it
+    try:
+        await asyncio.to_thread(get_store)
+    except Exception as e:
+        logger.error(f"Failed to warm up document store: {e}")
     logger.info("Starting task processor...")
     # await task_processor.start()
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
+    yield
     logger.info("Stopping task processor...")
     # await task_processor.stop()
 
+
+def create_app(config=settings) -> FastAPI:
+    """Build the API app and its middleware chain once for the given settings"""
+    app = FastAPI(
+        title="Archyx AI API",
+        description="Backend API for the Archyx AI chat application",
+        version="1.0.0",
+        lifespan=lifespan
+    )
+    _mount_hosts(app, config)
+    _mount_cors(app, config)
+    # Compress JSON responses large enough to benefit
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+    _mount_routes(app)
+    return app
+
+
+app = create_app(settings)
+
 if __name__ == "__main__":
     logger.info(f"Starting Archyx AI API on {settings.HOST}:{settings.PORT}")
     uvicorn.run("main:app", host=settings.HOST,
@@ -1,17 +1,26 @@
-from pydantic import BaseModel, Field, field_validator, ConfigDict
-from typing import Optional, Dict, Any, List
+from pydantic import AfterValidator, BaseModel, Field, ConfigDict
+from typing import Annotated, Optional, Dict, Any, List
+
+_ALLOWED_ROLES = frozenset({"user", "assistant", "system", "function"})
+
+
+def _clean_content(v: str) -> str:
+    v = v.strip()
+    if not v:
+        raise ValueError('Content cannot be empty')
+    return v
+
+
+def _check_role(v: str) -> str:
+    if v not in _ALLOWED_ROLES:
+        raise ValueError(f"Role must be one of: {', '.join(sorted(_ALLOWED_ROLES))}")
+    return v
 
 
 class MessageCreate(BaseModel):
-    content: str = Field(..., min_length=1, max_length=10000, description="Message content")
-    role: str = Field(default="user", pattern=r"^(user|assistant|system|function)$")
+    content: Annotated[str, AfterValidator(_clean_content)] = Field(..., min_length=1, max_length=10000, description="Message content")
+    role: Annotated[str, AfterValidator(_check_role)] = "user"
     metadata: Optional[Dict[str, Any]] = None
-    @field_validator('content')
-    @classmethod
-    def validate_content(cls, v):
-        if not v or not v.strip():
-            raise ValueError('Content cannot be empty')
-        return v.strip()
 
 
 class MessageUpdate(BaseModel):
@@ -20,7 +29,7 @@ class MessageUpdate(BaseModel):
 
 
 class MessageResponse(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True, extra='ignore')
     id: str
     chat_id: str
     user_id: Optional[str] = None
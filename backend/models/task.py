@@ -33,7 +33,7 @@ class TaskUpdate(BaseModel):
 
 class TaskResponse(BaseModel):
     """Task response - aligned with frontend Task type"""
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True, extra='ignore')
 
     id: str
     user_id: Optional[str] = None  # Match frontend optional field
@@ -58,12 +58,15 @@ class TaskResponse(BaseModel):
         """Convert backend task data to frontend-compatible format"""
         # Map 'type' field to 'command_id' for frontend compatibility
         if 'type' in task_data:
-            task_data['command_id'] = task_data.pop('type')
+            task_data = {**task_data, 'command_id': task_data['type']}
+            del task_data['type']
         return cls(**task_data)
 
 
 class TaskListResponse(BaseModel):
     """Paginated task list response"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     tasks: List[TaskResponse]
     total: int
     page: int
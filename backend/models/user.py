@@ -8,7 +8,7 @@ class User(BaseModel):
     Full user data with preferences, permissions, etc. is managed in frontend types
     This model only contains fields needed for backend API authentication and processing
     """
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True, extra='ignore')
 
     id: str
     email: Optional[str] = None
@@ -1,25 +1,80 @@
 import os
+import hashlib
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
+import functools
 import logging
-from datetime import datetime
-from typing import List, Dict, Any
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Union
+import numpy as np
 from chromadb import PersistentClient
+from diskcache import Cache
 from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from config import Settings
+from config import settings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-settings = Settings()
-
 DB_PATH = "./chroma_store"
 COLLECTION_NAME = "drive-docs"
+# LLM responses keyed by prompt hash; looked up by exact key, so they need no embedding
+PROMPT_CACHE_DIR = "./prompt_cache"
+PROMPT_CACHE_SIZE_LIMIT = 2 ** 26
 EMBEDDING_MODEL_NAME = "models/gemini-embedding-001"
-CHUNK_SIZE = 500
-CHUNK_OVERLAP = 50
-BATCH_SIZE = 10
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+# Texts per Gemini embedding request; batchEmbedContents accepts at most 100
+BATCH_SIZE = 100
+ADD_WINDOW_SIZE = 256
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+# Embedded chunks are written by a background thread, grouped into one upsert per this many
+# chunks or after this many idle seconds; the queue holds at most WRITE_QUEUE_SIZE windows
+WRITE_GROUP_SIZE = 1024
+WRITE_GROUP_INTERVAL = 1.0
+WRITE_QUEUE_SIZE = 8
+# HNSW settings for the document collection; only applied when the collection is first created
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:search_ef": 80,
+    "hnsw:num_threads": os.cpu_count() or 4,
+}
+
+def split_tags(tags_csv: str) -> List[str]:
+    """Tags stored as a comma-separated Chroma metadata string, back as a list."""
+    return [tag.strip() for tag in tags_csv.split(",") if tag.strip()] if tags_csv else []
+
+
+def prompt_key(prompt: str) -> str:
+    """Prompt cache id: a hash of the prompt with its whitespace normalised."""
+    return hashlib.sha256(" ".join(prompt.split()).encode("utf-8")).hexdigest()
+
+
+def chunk_header(meta: Dict[str, Any]) -> str:
+    """File header for a stored chunk, rebuilt from its metadata for the results actually returned."""
+    if "modified_time" not in meta:
+        # Chunks stored before the header moved into metadata still carry it in their text
+        return ""
+    return f"[File: {meta.get('file_name', 'unknown')} | Modified: {meta['modified_time']} | Size: {meta.get('size_mb', 0):.2f} MB]\n"
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that memoizes query vectors; documents pass straight through."""
+    def __init__(self, embeddings: Embeddings, maxsize: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self._embed_query = functools.lru_cache(maxsize=maxsize)(embeddings.embed_query)
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts, **kwargs)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_query(text.strip())
+
 
 class ChromaDocumentStore:
     """Main class for managing documents in ChromaDB."""
@@ -28,24 +83,96 @@ class ChromaDocumentStore:
             raise ValueError("GEMINI_API_KEY not configured")
         
         os.makedirs(DB_PATH, exist_ok=True)
+        # Documents may be embedded from several threads; keeps each file's delete/add pairs ordered
+        self._write_lock = threading.Lock()
+        # Ordered ("upsert" | "delete" | "flush", payload) operations for the writer thread
+        self._write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
         self.chroma_client = PersistentClient(path=DB_PATH)
-        self.collection = self.chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+        self.collection = self.chroma_client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            metadata=COLLECTION_METADATA
+        )
+        self.prompt_cache = Cache(
+            PROMPT_CACHE_DIR,
+            size_limit=PROMPT_CACHE_SIZE_LIMIT,
+            eviction_policy="least-recently-used"
+        )
         self.embedding_model_lc = GoogleGenerativeAIEmbeddings(
             model=EMBEDDING_MODEL_NAME,
             google_api_key=settings.GEMINI_API_KEY
         )
+        # Shared with the RAG vectorstore so both reuse one query-embedding cache
+        self.query_embeddings = CachedQueryEmbeddings(self.embedding_model_lc)
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=CHUNK_SIZE,
             chunk_overlap=CHUNK_OVERLAP,
             separators=["\n\n", "\n", ". ", " ", ""]
         )
+        # Reuse the store's client instead of letting LangChain open a second one on DB_PATH
         self.vectorstore = Chroma(
+            client=self.chroma_client,
             collection_name=COLLECTION_NAME,
-            embedding_function=self.embedding_model_lc,
-            persist_directory=DB_PATH
+            embedding_function=self.query_embeddings,
+            collection_metadata=COLLECTION_METADATA
         )
+        self._writer = threading.Thread(target=self._write_loop, name="chroma-writer", daemon=True)
+        self._writer.start()
         logger.info("ChromaDB initialized with Google AI embeddings")
     
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query, reusing the vector for repeated queries."""
+        return self.query_embeddings.embed_query(query)
+
+    def _write_loop(self) -> None:
+        """Apply queued writes in order, grouping consecutive upserts into one Chroma call."""
+        group, group_size = [], 0
+        while True:
+            try:
+                op, payload = self._write_queue.get(timeout=WRITE_GROUP_INTERVAL if group else None)
+            except queue.Empty:
+                op, payload = "idle", None
+            if op == "upsert":
+                group.append(payload)
+                group_size += len(payload[0])
+                if group_size < WRITE_GROUP_SIZE:
+                    continue
+            if group:
+                self._upsert_group(group)
+                group, group_size = [], 0
+            if op == "delete":
+                where, file_ids, failures = payload
+                try:
+                    with self._write_lock:
+                        self.collection.delete(where=where)
+                except Exception as e:
+                    logger.error(f"Error deleting chunks: {e}")
+                    if failures is not None:
+                        failures.update(file_ids)
+            elif op == "flush":
+                payload.set()
+
+    def _upsert_group(self, group) -> None:
+        try:
+            with self._write_lock:
+                self.collection.upsert(
+                    ids=[chunk_id for ids, _, _, _, _ in group for chunk_id in ids],
+                    embeddings=np.concatenate([embeddings for _, embeddings, _, _, _ in group]),
+                    documents=[text for _, _, texts, _, _ in group for text in texts],
+                    metadatas=[meta for _, _, _, metas, _ in group for meta in metas]
+                )
+        except Exception as e:
+            logger.error(f"Error writing {sum(len(ids) for ids, _, _, _, _ in group)} chunks: {e}")
+            # Each caller only learns about its own files
+            for _, _, _, metas, failures in group:
+                if failures is not None:
+                    failures.update(meta["file_id"] for meta in metas)
+
+    def flush_writes(self) -> None:
+        """Block until every write queued so far has been applied."""
+        done = threading.Event()
+        self._write_queue.put(("flush", done))
+        done.wait()
+
     def _chunk_text(self, text: str) -> List[str]:
         """Split text using RecursiveCharacterTextSplitter for better semantic preservation."""
         if not text:
@@ -54,72 +181,177 @@ class ChromaDocumentStore:
     
     def embed_document(self, text: str, file_id: str, file_name: str, 
                       modified_time: str, size_mb: float, parent_folder_id: str,
-                      tags: str = "", summary: str = "") -> bool:
+                      tags: Union[str, List[str]] = "", summary: str = "", batch_size: int = BATCH_SIZE,
+                      checksum: str = "") -> bool:
         """Embed a document by chunking it and storing in ChromaDB."""
-        try:
-            logger.info(f"Embedding document: {file_name}")
-            chunks = self._chunk_text(text)
+        logger.info(f"Embedding document: {file_name}")
+        failures = set()
+        embedded = self.embed_documents([{
+            "text": text,
+            "file_id": file_id,
+            "file_name": file_name,
+            "modified_time": modified_time,
+            "size_mb": size_mb,
+            "parent_folder_id": parent_folder_id,
+            "tags": tags,
+            "summary": summary,
+            "checksum": checksum,
+        }], batch_size, failures)[file_id]
+        self.flush_writes()
+        return embedded and file_id not in failures
+
+    def embed_documents(self, documents: List[Dict[str, Any]], batch_size: int = BATCH_SIZE,
+                        failures: Optional[set] = None) -> Dict[str, bool]:
+        """Embed several documents together so small files share full embedding batches."""
+        # The chunks are written in the background, so True only means they were queued; files
+        # whose writes then fail are added to failures, which is complete after flush_writes()
+        results = {}
+        # (chunk id, chunk text, metadata) for every chunk of every document, in order
+        pending = []
+        # New chunk count per file; chunks left with another count belong to a previous version
+        chunk_counts = {}
+        for doc in documents:
+            file_id, file_name = doc["file_id"], doc["file_name"]
+            chunks = self._chunk_text(doc.get("text"))
+            results[file_id] = bool(chunks)
             if not chunks:
                 logger.warning(f"No chunks created for {file_name}")
-                return False
-            
-            logger.info(f"Created {len(chunks)} chunks")
-            header = f"[File: {file_name} | Modified: {modified_time} | Size: {size_mb:.2f} MB]\n"
-            
-            for batch_start in range(0, len(chunks), BATCH_SIZE):
-                batch_chunks = chunks[batch_start:batch_start + BATCH_SIZE]
-                batch_num = batch_start // BATCH_SIZE + 1
-                total_batches = (len(chunks) + BATCH_SIZE - 1) // BATCH_SIZE
-                logger.info(f"Processing batch {batch_num}/{total_batches}")
-                
-                documents = [header + chunk for chunk in batch_chunks]
-                embeddings = self.embedding_model_lc.embed_documents(batch_chunks)
-                ids = [f"{file_id}_{batch_start + i}" for i in range(len(batch_chunks))]
-                metadatas = [{
-                    "file_id": file_id,
-                    "file_name": file_name,
-                    "file_path": f"{parent_folder_id}/{file_name}",
-                    "summary": summary,
-                    "tags": tags,
-                    "chunk_index": batch_start + i,
-                    "updated_at": datetime.utcnow().isoformat(),
-                    "parent_folder": parent_folder_id
-                } for i in range(len(batch_chunks))]
-                
-                self.collection.add(
-                    documents=documents,
-                    embeddings=embeddings,
-                    ids=ids,
-                    metadatas=metadatas
+                continue
+            logger.info(f"Created {len(chunks)} chunks for {file_name}")
+            # Every chunk of a file shares one metadata dict; a chunk's position is already in its id
+            base_meta = {
+                "file_id": file_id,
+                "file_name": file_name,
+                "file_path": f"{doc['parent_folder_id']}/{file_name}",
+                "summary": doc.get("summary") or "",
+                # Chroma metadata values are scalars; keep tags as one comma-separated string
+                "tags": ",".join(doc["tags"]) if isinstance(doc.get("tags"), list) else (doc.get("tags") or ""),
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "parent_folder": doc["parent_folder_id"],
+                "md5_checksum": doc.get("checksum") or "",
+                # The file header lives here rather than in every stored chunk; see chunk_header()
+                "modified_time": doc["modified_time"],
+                "size_mb": doc["size_mb"],
+                "size_bytes": int(round(doc["size_mb"] * 1024 * 1024)),
+                "chunk_count": len(chunks)
+            }
+            pending.extend((f"{file_id}_{i}", chunk, base_meta) for i, chunk in enumerate(chunks))
+            chunk_counts[file_id] = len(chunks)
+        file_ids = list(chunk_counts)
+        if not file_ids:
+            return results
+        try:
+            # Windows span file boundaries, so a run of small files still fills each embedding batch;
+            # only one window's texts, embeddings and metadata are held in memory together
+            for start in range(0, len(pending), ADD_WINDOW_SIZE):
+                window = pending[start:start + ADD_WINDOW_SIZE]
+                texts = [text for _, text, _ in window]
+                # embed_documents splits the request into batch_size calls itself; Chroma stores
+                # float32, so hand it one contiguous array instead of lists of Python floats
+                embeddings = np.asarray(
+                    self.embedding_model_lc.embed_documents(texts, batch_size=batch_size),
+                    dtype=np.float32
                 )
-            
-            logger.info(f"Successfully embedded {file_name}: {len(chunks)} chunks")
+                # Handed to the writer thread so embedding the next window never waits on Chroma
+                self._write_queue.put(("upsert", (
+                    [chunk_id for chunk_id, _, _ in window],
+                    embeddings,
+                    texts,
+                    [meta for _, _, meta in window],
+                    failures
+                )))
+            # The upserts overwrite chunks in place, so once the writer has applied them only a longer
+            # previous version's trailing chunks still carry another count (or, if stored before
+            # chunk_count existed, a chunk_index past the new end)
+            stale = [{"$and": [{"file_id": file_id}, {"$or": [{"chunk_count": {"$ne": count}},
+                                                             {"chunk_index": {"$gte": count}}]}]}
+                     for file_id, count in chunk_counts.items()]
+            self._write_queue.put(("delete", (stale[0] if len(stale) == 1 else {"$or": stale}, file_ids, failures)))
+            logger.info(f"Successfully embedded {len(file_ids)} documents: {len(pending)} chunks")
+        except Exception as e:
+            logger.error(f"Error embedding {', '.join(file_ids)}: {e}")
+            results.update(dict.fromkeys(file_ids, False))
+        return results
+    
+    def update_documents_metadata(self, updates: Dict[str, Dict[str, Any]]) -> bool:
+        """Merge new metadata into every stored chunk of each file, e.g. after a rename or move."""
+        if not updates:
+            return True
+        try:
+            # Queued upserts must land first or they would write the old metadata back
+            self.flush_writes()
+            with self._write_lock:
+                existing = self.collection.get(where={"file_id": {"$in": list(updates)}}, include=["metadatas"])
+                ids = existing.get("ids") or []
+                if ids:
+                    self.collection.update(
+                        ids=ids,
+                        metadatas=[updates[meta["file_id"]] for meta in existing["metadatas"]]
+                    )
+            logger.info(f"Updated metadata of {len(ids)} chunks for {len(updates)} files")
             return True
         except Exception as e:
-            logger.error(f"Error embedding {file_name}: {e}")
+            logger.error(f"Error updating metadata for {len(updates)} files: {e}")
             return False
-    
+
     def remove_document(self, file_id: str) -> bool:
         """Remove all chunks of a document."""
         try:
-            all_items = self.collection.get(include=["metadatas"])
-            ids_to_delete = [
-                id_ for id_, meta in zip(all_items["ids"], all_items["metadatas"])
-                if meta.get("file_id") == file_id
-            ]
-            if ids_to_delete:
-                self.collection.delete(ids=ids_to_delete)
-                logger.info(f"Removed {len(ids_to_delete)} chunks for {file_id}")
-                return True
-            return False
+            # Queued upserts for the file must land first or they would bring it back
+            self.flush_writes()
+            self.collection.delete(where={"file_id": file_id})
+            logger.info(f"Removed chunks for {file_id}")
+            return True
         except Exception as e:
             logger.error(f"Error removing {file_id}: {e}")
             return False
     
+    def remove_documents(self, file_ids: List[str]) -> bool:
+        """Remove all chunks of several documents in a single delete."""
+        if not file_ids:
+            return False
+        try:
+            self.flush_writes()
+            self.collection.delete(where={"file_id": {"$in": list(file_ids)}})
+            logger.info(f"Removed chunks for {len(file_ids)} files")
+            return True
+        except Exception as e:
+            logger.error(f"Error removing {len(file_ids)} files: {e}")
+            return False
+    
+    def get_document_checksum(self, file_id: str) -> Optional[str]:
+        """Drive md5Checksum of the content currently embedded for a file, if recorded."""
+        try:
+            result = self.collection.get(where={"file_id": file_id}, limit=1, include=["metadatas"])
+            metadatas = result.get("metadatas") or []
+            return metadatas[0].get("md5_checksum") or None if metadatas else None
+        except Exception as e:
+            logger.error(f"Error reading checksum for {file_id}: {e}")
+            return None
+
+    def get_document_checksums(self, file_ids: List[str]) -> Dict[str, str]:
+        """Recorded md5Checksums for many files in one query, keyed by file id."""
+        if not file_ids:
+            return {}
+        try:
+            # Only each file's first chunk, looked up by id, so the result stays one row per file
+            result = self.collection.get(
+                ids=[f"{file_id}_0" for file_id in file_ids],
+                include=["metadatas"]
+            )
+            return {
+                meta["file_id"]: meta["md5_checksum"]
+                for meta in result.get("metadatas") or []
+                if meta.get("file_id") and meta.get("md5_checksum")
+            }
+        except Exception as e:
+            logger.error(f"Error reading checksums: {e}")
+            return {}
+
     def search_documents(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """Search documents using semantic similarity."""
         try:
-            query_embedding = self.embedding_model_lc.embed_query(query)
+            query_embedding = self.embed_query(query)
             results = self.collection.query(
                 query_embeddings=[query_embedding],
                 n_results=top_k,
@@ -131,13 +363,13 @@ class ChromaDocumentStore:
             distances = results.get("distances", [[]])[0]
             for doc, meta, distance in zip(documents, metadatas, distances):
                 matches.append({
-                    "text": doc,
+                    "text": chunk_header(meta) + doc,
                     "similarity_score": 1 - distance,
                     "file_id": meta.get("file_id", "unknown"),
                     "file_name": meta.get("file_name", "unknown"),
                     "file_path": meta.get("file_path", ""),
                     "summary": meta.get("summary", ""),
-                    "tags": meta.get("tags", ""),
+                    "tags": split_tags(meta.get("tags", "")),
                     "updated_at": meta.get("updated_at", ""),
                     "parent_folder": meta.get("parent_folder", "")
                 })
@@ -147,36 +379,67 @@ class ChromaDocumentStore:
             logger.error(f"Error searching: {e}")
             return []
     
+    def get_cached_response(self, prompt: str) -> Optional[str]:
+        """Return a stored LLM response for the same prompt, up to whitespace."""
+        try:
+            # Exact matches only: prompts that differ in a single name ("Budget 2023" vs "Budget 2024")
+            # embed almost identically but must not share an answer
+            response = self.prompt_cache.get(prompt_key(prompt))
+            if response is not None:
+                logger.info("Prompt cache hit")
+            return response
+        except Exception as e:
+            logger.error(f"Error reading prompt cache: {e}")
+            return None
+
+    def cache_response(self, prompt: str, response: str) -> bool:
+        """Store an LLM response keyed by a hash of its prompt."""
+        try:
+            self.prompt_cache.set(prompt_key(prompt), response)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing prompt cache: {e}")
+            return False
+
     def get_vectorstore(self) -> Chroma:
         """Get LangChain vectorstore for RAG."""
         return self.vectorstore
 
 # Global instance for backward compatibility
 _store = None
+_store_lock = threading.Lock()
 
 def get_store():
     global _store
     if _store is None:
-        _store = ChromaDocumentStore()
+        # Double-checked so concurrent first callers do not open two clients on DB_PATH
+        with _store_lock:
+            if _store is None:
+                _store = ChromaDocumentStore()
     return _store
 
 # Legacy functions
-def embed_chunks(text, file_id, file_name, modified_time, size_mb, parent_folder_id, tags="", summary=""):
-    return get_store().embed_document(text, file_id, file_name, modified_time, size_mb, parent_folder_id, tags, summary)
-
-def remove_file(file_id):
-    return get_store().remove_document(file_id)
-
-def search_documents(query, top_k=5):
-    return get_store().search_documents(query, top_k)
-
-# For LangChain RAG
-embedding_model_lc = GoogleGenerativeAIEmbeddings(
-    model=EMBEDDING_MODEL_NAME,
-    google_api_key=settings.GEMINI_API_KEY
-)
-vectorstore = Chroma(
-    collection_name=COLLECTION_NAME,
-    embedding_function=embedding_model_lc,
-    persist_directory=DB_PATH
-)
+def embed_files(documents, batch_size=BATCH_SIZE, failures=None):
+    return get_store().embed_documents(documents, batch_size, failures)
+
+def flush_writes():
+    return get_store().flush_writes()
+
+def update_files_metadata(updates):
+    return get_store().update_documents_metadata(updates)
+
+def remove_files(file_ids):
+    return get_store().remove_documents(file_ids)
+
+def get_file_checksums(file_ids):
+    return get_store().get_document_checksums(file_ids)
+
+def get_cached_response(prompt):
+    return get_store().get_cached_response(prompt)
+
+def cache_response(prompt, response):
+    return get_store().cache_response(prompt, response)
+
+# For LangChain RAG; built on first use so importing this module stays cheap
+def get_vectorstore():
+    return get_store().get_vectorstore()
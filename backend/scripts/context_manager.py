@@ -1,13 +1,20 @@
+import asyncio
+from typing import Optional
 from utils.logger import logger
 
-async def create_prompt(user_supabase, user_id: str, chat_id: str, user_message: str) -> str:
+async def create_prompt(user_supabase, user_id: str, chat_id: str, user_message: str,
+                        chat_context: Optional[str] = None) -> str:
     try:
-        # Fetch user preferences
-        pref_resp = user_supabase.table("profiles").select("communication_style, response_length, system_prompt, temperature").eq("id", user_id).execute()
+        # Fetch user preferences, and the chat context summary unless the caller already loaded the chat;
+        # the client is synchronous, so the round trips run side by side in worker threads
+        queries = [user_supabase.table("profiles").select("communication_style, response_length, system_prompt, temperature").eq("id", user_id)]
+        if chat_context is None:
+            queries.append(user_supabase.table("chats").select("context_summary").eq("id", chat_id))
+        pref_resp, *chat_resps = await asyncio.gather(*(asyncio.to_thread(query.execute) for query in queries))
         preferences = pref_resp.data[0] if pref_resp.data else {}
-        # Fetch chat context summary
-        chat_resp = user_supabase.table("chats").select("context_summary").eq("id", chat_id).execute()
-        chat_context = chat_resp.data[0]["context_summary"] if chat_resp.data and chat_resp.data[0].get("context_summary") else ""
+        if chat_resps:
+            chat_resp = chat_resps[0]
+            chat_context = chat_resp.data[0]["context_summary"] if chat_resp.data and chat_resp.data[0].get("context_summary") else ""
         # Fetch system instructions (from a table or static, here static for simplicity)
         system_instructions = "You are a helpful AI assistant."
         prompt = f"""
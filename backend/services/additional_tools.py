@@ -1,12 +1,38 @@
-from storage.database import supabase
+from storage.database import supabase, select_all
+import functools
 import json
+import time
+from typing import Optional
 from services.generative_ai import generate_text
+from scripts.google_drive import escape_query_value
 from utils.sanitize import remove_null_chars
 
 
+# Bumped whenever file_metadata is written so the cached table is refetched
+_metadata_epoch = 0
+# Writes made outside this process (another sync, the dashboard) are picked up within this many seconds
+FILE_METADATA_TTL = 60
+
+# Seconds a suggested structure is reused, so a preview followed by organize costs one Gemini call
+SUGGESTION_TTL = 60
+# user id -> (prompt, metadata epoch, time, result) of that user's last suggestion
+_suggestion_cache = {}
+
+
+def invalidate_file_metadata_cache():
+    """Mark the cached file metadata table as stale."""
+    global _metadata_epoch
+    _metadata_epoch += 1
+
+
+@functools.lru_cache(maxsize=1)
+def _fetch_file_metadata(epoch: int, ttl_bucket: int):
+    return select_all(lambda: supabase.table("file_metadata").select("*").order("id"))
+
+
 def get_file_metadata_table():
     """
-    Fetches all file metadata records from Supabase.
+    Fetches all file metadata records from Supabase, cached until the next metadata write or FILE_METADATA_TTL.
     Returns:
         List[dict]: List of file metadata records.
     """
@@ -14,8 +40,7 @@ def get_file_metadata_table():
         if not supabase:
             print("Supabase client not initialized.")
             return []
-        response = supabase.table("file_metadata").select("*").execute()
-        data = response.data if hasattr(response, 'data') else response.get('data', [])
+        data = _fetch_file_metadata(_metadata_epoch, int(time.monotonic() // FILE_METADATA_TTL))
         if not data:
             return []
         # Optionally, map keys to camelCase if needed
@@ -24,14 +49,22 @@ def get_file_metadata_table():
         print(f"Error fetching file metadata: {e}")
         return []
 
-def suggest_folder_structure(user_prompt: str = "Suggest a folder structure for my drive based on my files."):
+def suggest_folder_structure(user_prompt: str = "Suggest a folder structure for my drive based on my files.",
+                             user_id: Optional[str] = None):
     """
     Suggests a folder/files/nested structure for the drive using Gemini, file metadata, and ChromaDB as a knowledge base (not prompt context).
     Args:
         user_prompt (str): The user's prompt or requirements for the structure.
+        user_id (str, optional): The requesting user; their last suggestion is reused, and nothing is cached without one.
     Returns:
         dict: Consistent format with suggested structure and status.
     """
+    # Matched on the metadata epoch too, so any metadata write invalidates the suggestion
+    cached = _suggestion_cache.get(user_id) if user_id else None
+    if (cached and cached[:2] == (user_prompt, _metadata_epoch)
+            and time.monotonic() - cached[2] < SUGGESTION_TTL):
+        return cached[3]
+    epoch = _metadata_epoch
     file_metadata = get_file_metadata_table()
     if not file_metadata:
         return {"status": "error", "message": "No file metadata found.", "structure": None}
@@ -58,10 +91,13 @@ Respond ONLY with the JSON array, no extra explanation.\n"""
         structure = json.loads(suggestion)
     except Exception:
         structure = suggestion
-    return {"status": "success", "structure": structure}
+    result = {"status": "success", "structure": structure}
+    if user_id:
+        _suggestion_cache[user_id] = (user_prompt, epoch, time.monotonic(), result)
+    return result
 
 # TODO: Check later
-def organize_drive_by_gemini(service, root_folder_id, user_prompt: str, supabase_client):
+def organize_drive_by_gemini(service, root_folder_id, user_prompt: str, supabase_client, user_id: Optional[str] = None):
     """
     Organizes Google Drive folders according to Gemini's suggested structure. Only folders/subfolders are created/updated. File names/content are not changed.
     Updates Supabase file_metadata table for new folders and updates/deletes previous entries as needed.
@@ -70,16 +106,38 @@ def organize_drive_by_gemini(service, root_folder_id, user_prompt: str, supabase
         root_folder_id: The root folder ID (should be a shared folder accessible to the service account).
         user_prompt: User's requirements for the structure.
         supabase_client: Supabase client for metadata updates.
+        user_id: The requesting user, so a structure they just previewed is applied without asking Gemini again.
     Returns:
         dict: Status and structure summary.
     """
-    result = suggest_folder_structure(user_prompt)
+    result = suggest_folder_structure(user_prompt, user_id)
     if result["status"] != "success" or not result["structure"]:
         return result
     structure = result["structure"]
     # structure is expected to be a list of folder objects as per schema
     created = []
     from datetime import datetime
+    # (parent_id, name) -> folder id; paths in one structure share prefixes, so each is looked up once
+    folder_ids = {}
+    def resolve_folder(parent_id, name):
+        key = (parent_id, name)
+        if key not in folder_ids:
+            results = service.files().list(
+                q=f"mimeType='application/vnd.google-apps.folder' and name='{escape_query_value(name)}' and '{parent_id}' in parents and trashed=false",
+                pageSize=1,
+                fields="files(id)"
+            ).execute()
+            folders = results.get("files", [])
+            if folders:
+                folder_ids[key] = folders[0]['id']
+            else:
+                folder_obj = service.files().create(body={
+                    'name': name,
+                    'mimeType': 'application/vnd.google-apps.folder',
+                    'parents': [parent_id]
+                }, fields="id, name").execute()
+                folder_ids[key] = folder_obj['id']
+        return folder_ids[key]
     for folder in structure:
         if not folder.get("file_type", True):
             continue  # Only create folders, not files
@@ -93,36 +151,10 @@ def organize_drive_by_gemini(service, root_folder_id, user_prompt: str, supabase
             parent_parts = folder_path.strip("/").split("/")[:-1]
             curr_parent = root_folder_id
             for part in parent_parts:
-                results = service.files().list(
-                    q=f"mimeType='application/vnd.google-apps.folder' and name='{part}' and '{curr_parent}' in parents and trashed=false",
-                    fields="files(id, name)"
-                ).execute()
-                folders = results.get("files", [])
-                if folders:
-                    curr_parent = folders[0]['id']
-                else:
-                    folder_obj = service.files().create(body={
-                        'name': part,
-                        'mimeType': 'application/vnd.google-apps.folder',
-                        'parents': [curr_parent]
-                    }, fields="id, name").execute()
-                    curr_parent = folder_obj['id']
+                curr_parent = resolve_folder(curr_parent, part)
             parent_id = curr_parent
         # Check if folder exists
-        results = service.files().list(
-            q=f"mimeType='application/vnd.google-apps.folder' and name='{folder_name}' and '{parent_id}' in parents and trashed=false",
-            fields="files(id, name)"
-        ).execute()
-        folders = results.get("files", [])
-        if folders:
-            folder_id = folders[0]['id']
-        else:
-            folder_obj = service.files().create(body={
-                'name': folder_name,
-                'mimeType': 'application/vnd.google-apps.folder',
-                'parents': [parent_id]
-            }, fields="id, name").execute()
-            folder_id = folder_obj['id']
+        folder_id = resolve_folder(parent_id, folder_name)
         # Remove previous entry if exists
         supabase_client.table("file_metadata").delete().eq("file_name", folder_name).eq("file_type", True).eq("file_path", folder_path).execute()
         # Insert new entry with sanitization
@@ -135,5 +167,6 @@ def organize_drive_by_gemini(service, root_folder_id, user_prompt: str, supabase
             "updated_at": datetime.utcnow().isoformat()
         })).execute()
         created.append({"file_name": folder_name, "id": folder_id, "file_path": folder_path, "summary": summary, "tags": tags})
+    invalidate_file_metadata_cache()
     return {"status": "applied", "structure": structure, "created_folders": created}
     
\ No newline at end of file
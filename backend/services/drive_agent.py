@@ -8,23 +8,25 @@ from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI, HarmBlockThreshold, HarmCategory
 from config import settings
-from scripts.google_drive import GoogleDriveService
+from scripts.google_drive import get_drive_service
 from utils.logger import logger
 from utils.user_security import get_security_service
-from langchain.chains import RetrievalQA
-from scripts.chroma import vectorstore
 import asyncio
 from services.additional_tools import (
     get_file_metadata_table,
+    invalidate_file_metadata_cache,
     suggest_folder_structure,
     organize_drive_by_gemini,
 )
 from utils.sanitize import extract_json_from_string
 
+# Items a listing tool hands the LLM; the sync lists the whole Drive through the service directly
+LIST_TOOL_MAX_RESULTS = 200
+
 
 class GoogleDriveAgent:
     def __init__(self, user_id: Optional[str] = None, user_supabase_client=None, llm=None):
-        self.drive_service = GoogleDriveService()
+        self.drive_service = get_drive_service()
         self.user_id = user_id or "anonymous"
         self.user_supabase = user_supabase_client
         self.security_service = get_security_service(user_supabase_client) if user_supabase_client else None
@@ -63,6 +65,7 @@ class GoogleDriveAgent:
             return
         try:
             version_id = self._get_or_create_version(f"{change_type.title()} operation")
+            now = datetime.utcnow().isoformat()
             change_data = {
                 "version_id": version_id,
                 "type": change_type,
@@ -70,7 +73,7 @@ class GoogleDriveAgent:
                 "new_path": new_path,
                 "description": f"{change_type} operation on {old_path}",
                 "user_id": self.user_id,
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": now
             }
             self.user_supabase.table("changes").insert(change_data).execute()
             # Update file_metadata for folder changes
@@ -83,11 +86,13 @@ class GoogleDriveAgent:
                     "file_path": metadata.get("file_path"),
                     "summary": metadata.get("summary", ""),
                     "tags": metadata.get("tags", []),
-                    "updated_at": datetime.utcnow().isoformat()
+                    "updated_at": now
                 }).execute()
             elif change_type == "deleted" and metadata:
                 # Remove folder metadata
                 self.user_supabase.table("file_metadata").delete().eq("file_name", metadata.get("file_name")).eq("file_type", True).eq("file_path", metadata.get("file_path")).execute()
+            if metadata:
+                invalidate_file_metadata_cache()
         except Exception as e:
             logger.error(f"Error tracking change: {e}")
 
@@ -96,13 +101,14 @@ class GoogleDriveAgent:
         try:
             if self.version_id:
                 return self.version_id
+            now = datetime.utcnow()
             version_data = {
-                "version": f"v{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}",
+                "version": f"v{now.strftime('%Y%m%d_%H%M%S')}",
                 "title": "Drive Changes",
                 "description": description,
                 "user_id": self.user_id,
-                "created_at": datetime.utcnow().isoformat(),
-                "timestamp": datetime.utcnow().isoformat(),
+                "created_at": now.isoformat(),
+                "timestamp": now.isoformat(),
                 "data": {}
             }
             version_response = self.user_supabase.table("versions").insert(version_data).execute()
@@ -131,71 +137,104 @@ class GoogleDriveAgent:
         # Handle simple string inputs
         return {"query": input_str}
 
+    def _list_tool(self, func):
+        """Wrap a Drive listing so the agent gets at most LIST_TOOL_MAX_RESULTS items"""
+        def wrapped_func(input_str):
+            try:
+                args = self._parse_tool_input(input_str)
+                if "query" in args:
+                    # A bare string input is the folder id
+                    args["folder_id"] = args.pop("query")
+                # One extra item shows whether the listing was cut short
+                items = func(**args, max_results=LIST_TOOL_MAX_RESULTS + 1) or []
+                if len(items) > LIST_TOOL_MAX_RESULTS:
+                    items = items[:LIST_TOOL_MAX_RESULTS] + [{
+                        "truncated": f"Only the first {LIST_TOOL_MAX_RESULTS} items are shown; list a specific folder to see the rest"
+                    }]
+                return json.dumps(items)
+            except Exception as e:
+                logger.error(f"Error in listing tool {func.__name__}: {e}")
+                return json.dumps({"error": str(e)})
+        return wrapped_func
+
+    def _create_folder_change(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(
+            id=args.get("folder_id", str(uuid.uuid4())),
+            change_type="added",
+            old_path=args.get("folder_name", ""),
+            new_path=args.get("folder_name", ""),
+            metadata={
+                "file_name": args.get("folder_name", ""),
+                "file_path": args.get("parent_ids", [self.drive_service.get_default_folder_id()])[0] if args.get("parent_ids") else self.drive_service.get_default_folder_id(),
+                "summary": f"Created folder: {args.get('folder_name', '')}",
+                "tags": ["folder", "created"]
+            }
+        )
+
+    def _move_file_change(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(
+            id=args.get("file_id", str(uuid.uuid4())),
+            change_type="modified",
+            old_path=args.get("file_id", ""),
+            new_path=args.get("new_parent_id", ""),
+            metadata={
+                "file_name": args.get("file_id", ""),
+                "file_path": args.get("new_parent_id", ""),
+                "summary": f"Moved file {args.get('file_id', '')} to {args.get('new_parent_id', '')}",
+                "tags": ["file", "moved"]
+            }
+        )
+
+    def _delete_file_change(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(
+            id=args.get("file_id", str(uuid.uuid4())),
+            change_type="deleted",
+            old_path=args.get("file_id", ""),
+            new_path=None,
+            metadata={
+                "file_name": args.get("file_id", ""),
+                "file_path": "",
+                "summary": f"Deleted file: {args.get('file_id', '')}",
+                "tags": ["file", "deleted"]
+            }
+        )
+
+    def _rename_file_change(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(
+            id=args.get("file_id", str(uuid.uuid4())),
+            change_type="modified",
+            old_path=args.get("file_id", ""),
+            new_path=args.get("new_name", ""),
+            metadata={
+                "file_name": args.get("new_name", ""),
+                "file_path": args.get("file_id", ""),
+                "summary": f"Renamed file {args.get('file_id', '')} to {args.get('new_name', '')}",
+                "tags": ["file", "renamed"]
+            }
+        )
+
+    # Write operations and the builder for the change record each one produces
+    _CHANGE_BUILDERS = {
+        "create_folder": _create_folder_change,
+        "move_file": _move_file_change,
+        "delete_file": _delete_file_change,
+        "rename_file": _rename_file_change,
+    }
+
     def _wrap_drive_tool(self, func, operation: str, change_type: str = None):
         """Wrap drive tools with permission checks and change tracking"""
+        build_change = self._CHANGE_BUILDERS.get(operation)
         def wrapped_func(input_str):
             try:
                 args = self._parse_tool_input(input_str)
                 # Check write permission for operations that modify drive
-                if operation in ["create_folder", "move_file", "delete_file", "rename_file"]:
-                    if not ("write" in self.permissions):
-                        return json.dumps({"error": f"Permission denied: 'write' permission required for {operation}"})
+                if build_change and "write" not in self.permissions:
+                    return json.dumps({"error": f"Permission denied: 'write' permission required for {operation}"})
                 # Execute the original function
                 result = func(**args)
                 # Track changes for specified operations
-                if change_type and operation in ["create_folder", "move_file", "delete_file", "rename_file"]:
-                    if operation == "create_folder":
-                        self._track_change(
-                            id=args.get("folder_id", str(uuid.uuid4())),
-                            change_type="added",
-                            old_path=args.get("folder_name", ""),
-                            new_path=args.get("folder_name", ""),
-                            metadata={
-                                "file_name": args.get("folder_name", ""),
-                                "file_path": args.get("parent_ids", [self.drive_service.get_default_folder_id()])[0] if args.get("parent_ids") else self.drive_service.get_default_folder_id(),
-                                "summary": f"Created folder: {args.get('folder_name', '')}",
-                                "tags": ["folder", "created"]
-                            }
-                        )
-                    elif operation == "move_file":
-                        self._track_change(
-                            id=args.get("file_id", str(uuid.uuid4())),
-                            change_type="modified",
-                            old_path=args.get("file_id", ""),
-                            new_path=args.get("new_parent_id", ""),
-                            metadata={
-                                "file_name": args.get("file_id", ""),
-                                "file_path": args.get("new_parent_id", ""),
-                                "summary": f"Moved file {args.get('file_id', '')} to {args.get('new_parent_id', '')}",
-                                "tags": ["file", "moved"]
-                            }
-                        )
-                    elif operation == "delete_file":
-                        self._track_change(
-                            id=args.get("file_id", str(uuid.uuid4())),
-                            change_type="deleted",
-                            old_path=args.get("file_id", ""),
-                            new_path=None,
-                            metadata={
-                                "file_name": args.get("file_id", ""),
-                                "file_path": "",
-                                "summary": f"Deleted file: {args.get('file_id', '')}",
-                                "tags": ["file", "deleted"]
-                            }
-                        )
-                    elif operation == "rename_file":
-                        self._track_change(
-                            id=args.get("file_id", str(uuid.uuid4())),
-                            change_type="modified",
-                            old_path=args.get("file_id", ""),
-                            new_path=args.get("new_name", ""),
-                            metadata={
-                                "file_name": args.get("new_name", ""),
-                                "file_path": args.get("file_id", ""),
-                                "summary": f"Renamed file {args.get('file_id', '')} to {args.get('new_name', '')}",
-                                "tags": ["file", "renamed"]
-                            }
-                        )
+                if change_type and build_change:
+                    self._track_change(**build_change(self, args))
                 return json.dumps(result) if isinstance(result, (dict, list)) else str(result)
             except Exception as e:
                 logger.error(f"Error in tool {operation}: {e}")
@@ -204,12 +243,17 @@ class GoogleDriveAgent:
 
     def _create_agent(self):
         """Create the agent with modern LangChain patterns"""
+        # Imported here so loading this module does not build the embedding model and Chroma store
+        from langchain.chains import RetrievalQA
+        from scripts.chroma import get_vectorstore
         # RAG: Build retriever and QA chain
-        retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 5})
+        retriever = get_vectorstore().as_retriever(search_type="similarity", search_kwargs={"k": 5})
         qa_chain = RetrievalQA.from_chain_type(
             llm=self.llm,
             retriever=retriever,
-            return_source_documents=True
+            return_source_documents=True,
+            # Stored chunks no longer repeat the file header, so name the file when stuffing them
+            chain_type_kwargs={"document_prompt": PromptTemplate.from_template("[File: {file_name}]\n{page_content}")}
         )
         
         def doc_qa_tool(input_text):
@@ -221,18 +265,18 @@ class GoogleDriveAgent:
             args = self._parse_tool_input(input_str)
             prompt = args.get("prompt", input_str)
             folder_id = args.get("folder_id", self.drive_service.get_default_folder_id())
-            return organize_drive_by_gemini(self.drive_service.service, folder_id, prompt, self.user_supabase)
+            return organize_drive_by_gemini(self.drive_service.service, folder_id, prompt, self.user_supabase, self.user_id)
 
         tools = [
             Tool(
                 name="ListAllItems",
-                func=self.drive_service.list_files_recursively,
-                description="Recursively list all files and folders starting from folder_id (None = all accessible files/folders). Input: JSON with 'folder_id' (optional). Returns a flat list of all items."
+                func=self._list_tool(self.drive_service.list_files_recursively),
+                description="Recursively list all files and folders starting from folder_id (None = all accessible files/folders). Input: JSON with 'folder_id' (optional). Returns a flat list of at most 200 items, ending with a 'truncated' note if there are more."
             ),
             Tool(
                 name="ListFilesInFolder",
-                func=self.drive_service.list_files_in_folder,
-                description="List files in Google Drive folder without going into subfolders. Input: JSON with 'folder_id' (optional), 'folder_name' (optional). If neither provided, lists all accessible files."
+                func=self._list_tool(self.drive_service.list_files_in_folder),
+                description="List files in Google Drive folder without going into subfolders. Input: JSON with 'folder_id' (optional), 'folder_name' (optional). If neither provided, lists all accessible files. Returns at most 200 items, ending with a 'truncated' note if there are more."
             ),
             Tool(
                 name="GetFileInfo",
@@ -289,7 +333,8 @@ class GoogleDriveAgent:
             ),
             Tool(
                 name="SuggestFolderStructure",
-                func=lambda input_str: suggest_folder_structure(input_str if input_str else "Suggest a folder structure for my drive based on my files."),
+                func=lambda input_str: suggest_folder_structure(
+                    input_str if input_str else "Suggest a folder structure for my drive based on my files.", self.user_id),
                 description="Classify or Suggest a nested folders/files structure for the drive based on all files metadata information. Input: user prompt string. Returns a consistent JSON structure."
             ),
             # Tool(
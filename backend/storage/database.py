@@ -1,3 +1,4 @@
+import functools
 from supabase import create_client, Client, ClientOptions
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
@@ -23,32 +24,48 @@ else:
 
 security = HTTPBearer()
 
+# PostgREST caps each response (1000 rows by default), so whole-table reads go page by page
+SELECT_PAGE_SIZE = 1000
+
+
+def select_all(make_query, page_size: int = SELECT_PAGE_SIZE) -> list:
+    """Every row of a query, fetched in ranges; make_query builds a fresh ordered select each call"""
+    rows = []
+    start = 0
+    while True:
+        page = make_query().range(start, start + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        start += page_size
+
 # Function to get authenticated supabase client for user requests
 
 
+@functools.lru_cache(maxsize=256)
+def _create_user_client(token: str) -> Client:
+    # Cached per token so a user's requests share one client and its HTTP connection pool
+    options = ClientOptions(
+        headers={
+            "Authorization": f"Bearer {token}",
+            "apikey": settings.SUPABASE_ANON_KEY
+        }
+    )
+    return create_client(
+        settings.SUPABASE_URL,
+        settings.SUPABASE_ANON_KEY,
+        options=options
+    )
+
+
 def get_user_supabase_client(token: str) -> Client:
-    """Create a Supabase client with user authentication token for RLS"""
+    """Get a Supabase client with user authentication token for RLS"""
     try:
         # Validate token format
         if not token or len(token) < 10:
             raise ValueError("Invalid token format")
 
-        # Create options with proper headers
-        options = ClientOptions(
-            headers={
-                "Authorization": f"Bearer {token}",
-                "apikey": settings.SUPABASE_ANON_KEY
-            }
-        )
-
-        # Create a new client with user authentication
-        user_client = create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_ANON_KEY,
-            options=options
-        )
-
-        return user_client
+        return _create_user_client(token)
     except Exception as e:
         logger.error(f"Failed to create authenticated Supabase client: {e}")
         raise HTTPException(
@@ -81,7 +98,7 @@ async def get_current_user(
         # Verify JWT token with Supabase
         response = supabase.auth.get_user(token)
         if response.user:
-            return User(id=response.user.id, email=response.user.email)
+            return User.model_construct(id=response.user.id, email=response.user.email)
         else:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
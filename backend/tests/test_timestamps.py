@@ -0,0 +1,27 @@
+from utils.timestamps import same_timestamp
+
+
+def test_drive_z_suffix_matches_supabase_offset():
+    assert same_timestamp("2024-01-01T00:00:00.000Z", "2024-01-01T00:00:00+00:00")
+
+
+def test_short_fraction_matches_drive_milliseconds():
+    assert same_timestamp("2024-05-03T10:20:30.12+00:00", "2024-05-03T10:20:30.120Z")
+
+
+def test_different_offsets_same_instant():
+    assert same_timestamp("2024-01-01T02:00:00+02:00", "2024-01-01T00:00:00.000Z")
+
+
+def test_different_instants():
+    assert not same_timestamp("2024-01-01T00:00:01.000Z", "2024-01-01T00:00:00+00:00")
+
+
+def test_missing_values():
+    assert same_timestamp(None, "")
+    assert not same_timestamp(None, "2024-01-01T00:00:00.000Z")
+
+
+def test_unparseable_values_compare_as_text():
+    assert same_timestamp("not a date", "not a date")
+    assert not same_timestamp("not a date", "2024-01-01T00:00:00.000Z")
@@ -1,23 +1,17 @@
+import json
+import re
+
+_JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.S)
+
+
 def extract_json_from_string(ai_result):
     """Extract and parse JSON from Gemini string response, handling backticks, 'json' prefix, and extra text."""
-    import json
     if not isinstance(ai_result, str):
         return None
-    s = ai_result.strip()
-    if s.startswith('```'):
-        s = s.lstrip('`').strip()
-    if s.lower().startswith('json'):
-        s = s[4:].strip()
-    start = s.find('{')
-    end = s.rfind('}')
-    if start != -1 and end != -1:
-        json_str = s[start:end+1]
-        try:
-            return json.loads(json_str)
-        except Exception:
-            return None
+    # Outermost {...} span, ignoring any ```json fences or surrounding prose
+    match = _JSON_OBJECT_PATTERN.search(ai_result)
     try:
-        return json.loads(s)
+        return json.loads(match.group(0) if match else ai_result.strip())
     except Exception:
         return None
 
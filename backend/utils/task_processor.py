@@ -213,13 +213,13 @@ class TaskProcessor:
             current_logs = response.data[0]["logs"] if response.data else []
 
             # Add new log with timestamp
-            timestamp = datetime.utcnow().strftime("%H:%M:%S")
-            new_log = f"[{timestamp}] {message}"
+            now = datetime.utcnow()
+            new_log = f"[{now.strftime('%H:%M:%S')}] {message}"
             updated_logs = current_logs + [new_log]
 
             supabase.table("tasks").update({
                 "logs": updated_logs,
-                "updated_at": datetime.utcnow().isoformat()
+                "updated_at": now.isoformat()
             }).eq("id", task_id).execute()
         except Exception as e:
             logger.error(f"Error adding log to task {task_id}: {e}")
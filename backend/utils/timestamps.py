@@ -0,0 +1,24 @@
+import re
+from datetime import datetime
+
+# Fractional seconds of any length, which fromisoformat only accepts from Python 3.11
+_FRACTION_PATTERN = re.compile(r'\.(\d+)')
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse a Supabase TIMESTAMPTZ or Drive RFC 3339 string, including a trailing "Z"."""
+    value = value.strip()
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'
+    value = _FRACTION_PATTERN.sub(lambda m: '.' + m.group(1)[:6].ljust(6, '0'), value, count=1)
+    return datetime.fromisoformat(value)
+
+
+def same_timestamp(a, b) -> bool:
+    """Compare Supabase TIMESTAMPTZ and Drive RFC 3339 strings as instants rather than as text."""
+    if not a or not b:
+        return (a or '') == (b or '')
+    try:
+        return parse_timestamp(a) == parse_timestamp(b)
+    except ValueError:
+        return a == b
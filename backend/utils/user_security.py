@@ -3,6 +3,7 @@ User Security and Constraints Service
 Handles user permission checks, rate limiting, and security validations
 """
 
+import re
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 from dataclasses import dataclass
@@ -10,6 +11,27 @@ from utils.logger import logger
 from storage.database import get_user_supabase_client
 from models.user import User
 
+# All prompt-safety patterns compiled into a single case-insensitive alternation
+_SUSPICIOUS_PATTERN = re.compile(
+    "|".join([
+        r"system\s*:",
+        r"ignore\s+previous\s+instructions",
+        r"act\s+as\s+if\s+you\s+are",
+        r"pretend\s+to\s+be",
+        r"jailbreak",
+        r"developer\s+mode",
+        r"<script",
+        r"javascript:",
+        r"eval\s*\(",
+        r"exec\s*\(",
+        r"__import__",
+        r"subprocess",
+        r"os\.system",
+        r"shell\s*=\s*true"
+    ]),
+    re.IGNORECASE
+)
+
 
 @dataclass
 class UserConstraints:
@@ -151,34 +173,14 @@ class UserSecurityService:
         """Validate that the prompt is safe and doesn't contain malicious content"""
         try:
             # Basic safety checks
-            suspicious_patterns = [
-                r"system\s*:",
-                r"ignore\s+previous\s+instructions",
-                r"act\s+as\s+if\s+you\s+are",
-                r"pretend\s+to\s+be",
-                r"jailbreak",
-                r"developer\s+mode",
-                r"<script",
-                r"javascript:",
-                r"eval\s*\(",
-                r"exec\s*\(",
-                r"__import__",
-                r"subprocess",
-                r"os\.system",
-                r"shell\s*=\s*true"
-            ]
-
-            import re
-            prompt_lower = prompt.lower()
-
-            for pattern in suspicious_patterns:
-                if re.search(pattern, prompt_lower):
-                    logger.warning(f"Suspicious pattern detected: {pattern}")
-                    return SecurityCheck(
-                        allowed=False,
-                        reason="Message contains potentially unsafe content",
-                        suggestions=["Please rephrase your message"]
-                    )
+            match = _SUSPICIOUS_PATTERN.search(prompt)
+            if match:
+                logger.warning(f"Suspicious pattern detected: {match.group(0)}")
+                return SecurityCheck(
+                    allowed=False,
+                    reason="Message contains potentially unsafe content",
+                    suggestions=["Please rephrase your message"]
+                )
 
             # Check for excessive length (potential DoS)
             if len(prompt) > 50000:  # 50KB limit
@@ -240,25 +242,18 @@ class UserSecurityService:
         try:
             updates = {}
 
-            if tokens_used > 0:
-                # Increment tokens_used
+            if tokens_used > 0 or messages_count > 0:
+                # Read both counters in one round trip
                 response = self.user_supabase.table("profiles").select(
-                    "tokens_used"
+                    "tokens_used, messages_count"
                 ).eq("id", user_id).single().execute()
+                current = response.data or {}
 
-                current_tokens = response.data.get(
-                    "tokens_used", 0) if response.data else 0
-                updates["tokens_used"] = current_tokens + tokens_used
-
-            if messages_count > 0:
-                # Increment messages_count
-                response = self.user_supabase.table("profiles").select(
-                    "messages_count"
-                ).eq("id", user_id).single().execute()
+                if tokens_used > 0:
+                    updates["tokens_used"] = (current.get("tokens_used") or 0) + tokens_used
 
-                current_messages = response.data.get(
-                    "messages_count", 0) if response.data else 0
-                updates["messages_count"] = current_messages + messages_count
+                if messages_count > 0:
+                    updates["messages_count"] = (current.get("messages_count") or 0) + messages_count
 
             if updates:
                 updates["last_active"] = datetime.utcnow().isoformat()
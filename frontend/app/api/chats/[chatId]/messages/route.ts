@@ -1,6 +1,23 @@
 import { NextRequest, NextResponse } from "next/server"
 import { createSupabaseServerClient } from "@/lib/supabase/server"
 
+// Opaque cursor over (created_at, id), the order messages are returned in, so rows sharing a
+// created_at with the last message of a page are not skipped
+function encodeCursor(message: { created_at: string; id: string }) {
+  return Buffer.from(JSON.stringify([message.created_at, message.id])).toString("base64url")
+}
+
+function decodeCursor(cursor: string): [string, string] | null {
+  try {
+    const value = JSON.parse(Buffer.from(cursor, "base64url").toString("utf8"))
+    return Array.isArray(value) && value.length === 2 && value.every((part) => typeof part === "string")
+      ? [value[0], value[1]]
+      : null
+  } catch {
+    return null
+  }
+}
+
 export async function GET(request: NextRequest, { params }: { params: { chatId: string } }) {
   try {
     const supabase = createSupabaseServerClient()
@@ -28,13 +45,30 @@ export async function GET(request: NextRequest, { params }: { params: { chatId:
     const { searchParams } = new URL(request.url)
     const limit = Math.min(parseInt(searchParams.get("limit") || "50"), 100)
     const offset = Math.max(parseInt(searchParams.get("offset") || "0"), 0)
+    // Position of the last message already seen; seeks past it instead of skipping offset rows
+    const cursorParam = searchParams.get("cursor")
+    const cursor = cursorParam ? decodeCursor(cursorParam) : null
+    if (cursorParam && !cursor) {
+      return NextResponse.json({ error: "Invalid cursor" }, { status: 400 })
+    }
 
-    const { data, error } = await supabase
+    let query = supabase
       .from("messages")
       .select("*")
       .eq("chat_id", params.chatId)
       .order("created_at", { ascending: true })
-      .range(offset, offset + limit - 1)
+      .order("id", { ascending: true })
+
+    if (cursor) {
+      const [createdAt, id] = cursor
+      query = query
+        .or(`created_at.gt."${createdAt}",and(created_at.eq."${createdAt}",id.gt."${id}")`)
+        .limit(limit)
+    } else {
+      query = query.range(offset, offset + limit - 1)
+    }
+
+    const { data, error } = await query
 
     if (error) {
       return NextResponse.json({ error: error.message }, { status: 500 })
@@ -46,6 +80,7 @@ export async function GET(request: NextRequest, { params }: { params: { chatId:
         limit,
         offset,
         total: data.length,
+        next_cursor: data.length === limit ? encodeCursor(data[data.length - 1]) : null,
       },
     })
   } catch (error) {
@@ -1,3 +1,4 @@
+import { createHash } from "crypto"
 import { NextRequest, NextResponse } from "next/server"
 import { createSupabaseServerClient } from "@/lib/supabase/server"
 
@@ -24,7 +25,14 @@ export async function GET(request: NextRequest, { params }: { params: { taskId:
       return NextResponse.json({ error: "Task not found" }, { status: 404 })
     }
 
-    return NextResponse.json(data)
+    // Progress polls revalidate with If-None-Match and get a bodyless 304 while the task is unchanged
+    const etag = `"${createHash("md5").update(String(data.updated_at)).digest("hex")}"`
+    const cacheHeaders = { ETag: etag, "Cache-Control": "private, no-cache" }
+    if (request.headers.get("if-none-match") === etag) {
+      return new NextResponse(null, { status: 304, headers: cacheHeaders })
+    }
+
+    return NextResponse.json(data, { headers: cacheHeaders })
   } catch (error) {
     return NextResponse.json({ error: "Internal server error" }, { status: 500 })
   }
@@ -60,10 +60,11 @@ export class APIClient {
   }
 
   // Messages Fetching
-  static async getChatMessages(chatId: string, params?: { limit?: number; offset?: number }) {
+  static async getChatMessages(chatId: string, params?: { limit?: number; offset?: number; cursor?: string }) {
     const searchParams = new URLSearchParams()
     if (params?.limit) searchParams.set("limit", String(params.limit))
     if (params?.offset) searchParams.set("offset", String(params.offset))
+    if (params?.cursor) searchParams.set("cursor", params.cursor)
 
     const response = await fetch(`/api/chats/${chatId}/messages?${searchParams}`)
     if (!response.ok) {
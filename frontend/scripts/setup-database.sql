@@ -332,6 +332,21 @@ CREATE TABLE IF NOT EXISTS file_metadata (
   updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- =====================================================
+-- DRIVE SYNC STATE TABLE
+-- =====================================================
+-- Drive changes.list page token of each user's last completed sync
+CREATE TABLE IF NOT EXISTS drive_sync_state (
+  user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE PRIMARY KEY,
+  page_token TEXT NOT NULL,
+  updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+ALTER TABLE drive_sync_state ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can manage own drive sync state" ON drive_sync_state
+  FOR ALL USING (auth.uid() = user_id) WITH CHECK (auth.uid() = user_id);
+
 -- Enable RLS and create policies for attachments
 ALTER TABLE attachments ENABLE ROW LEVEL SECURITY;
 
@@ -876,6 +891,10 @@ CREATE INDEX IF NOT EXISTS idx_chats_title_fts ON chats USING GIN(to_tsvector('e
 
 -- Additional useful indexes
 CREATE INDEX IF NOT EXISTS idx_messages_context_retrieval ON messages(chat_id, deleted, created_at DESC) WHERE deleted = false;
+-- Keyset-paginated chat history: equality on chat_id, then (created_at, id) in the route's sort order
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages(chat_id, created_at, id);
+-- The chat list filters on user_id and shows the most recently active chats first
+CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats(user_id, updated_at DESC);
 CREATE INDEX IF NOT EXISTS idx_messages_content_search ON messages USING GIN(to_tsvector('english', content)) WHERE deleted = false;
 
 -- =====================================================